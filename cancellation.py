@@ -0,0 +1,64 @@
+import asyncio
+import functools
+from typing import Dict
+
+from fastapi.responses import Response
+
+DISCONNECT_POLL_SECONDS = 0.5
+# 客户端已断开，这个状态码只会出现在日志里
+CLIENT_CLOSED_REQUEST = 499
+
+cancellation_stats: Dict[str, int] = {}
+
+
+def count_cancellation(stage: str):
+    cancellation_stats[stage] = cancellation_stats.get(stage, 0) + 1
+
+
+class cancellation_scope:
+    # 统计在某个阶段被取消的次数，异常照常向上抛
+    __slots__ = ("stage",)
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            count_cancellation(self.stage)
+        return False
+
+
+def cancel_on_disconnect(endpoint):
+    # endpoint 需要声明 request: Request 参数
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        request = kwargs["request"]
+        # 先把请求体读完，避免轮询断开时和 endpoint 抢 receive()
+        try:
+            await request.body()
+        except RuntimeError:
+            pass  # 表单已经被 FastAPI 读取
+
+        task = asyncio.ensure_future(endpoint(*args, **kwargs))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+                if done:
+                    return task.result()
+                if await request.is_disconnected():
+                    print(f"Client disconnected, cancelling {request.url.path}")
+                    count_cancellation("request")
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+                    return Response(status_code=CLIENT_CLOSED_REQUEST)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    return wrapper
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from array import array
+from typing import Dict, List, Optional
+
+import numpy as np
+
+LIBRARY_DIRECTORY = os.getenv("LIBRARY_INDEX_DIR", "./library_index")
+# hashing 或 sentence-transformers:<model name>
+LIBRARY_ENCODER = os.getenv("LIBRARY_ENCODER", "hashing")
+CHUNK_CHARS = 1500
+CHUNK_OVERLAP = 200
+INITIAL_CAPACITY = 1024
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEncoder:
+    # 纯本地的特征哈希编码，不依赖任何模型文件
+    def __init__(self, dimension: int = 1024):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        tokens = _token_re.findall(text.lower())
+        # 单词 + 相邻词对，crc32 在不同进程间稳定（内置 hash 不是）
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if not features:
+            return vector
+
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features),
+                             dtype=np.uint32, count=len(features))
+        buckets = (hashes % self.dimension).astype(np.intp)
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, buckets, signs)
+        # 次线性词频，避免长文本中高频词主导
+        np.copyto(vector, np.sign(vector) * np.log1p(np.abs(vector)))
+        return vector
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        matrix = np.vstack([self._encode_one(text) for text in texts]) if texts else \
+            np.zeros((0, self.dimension), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEncoder:
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("LIBRARY_ENCODER=sentence-transformers requires the sentence-transformers package")
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers-{model_name}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True).astype(np.float32)
+
+
+def load_encoder(spec: str = LIBRARY_ENCODER):
+    if spec.startswith("sentence-transformers"):
+        _, _, model_name = spec.partition(":")
+        return SentenceTransformerEncoder(model_name or "all-MiniLM-L6-v2")
+    return HashingEncoder()
+
+
+def chunk_text(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            # 尽量在空白处断开
+            split = text.rfind(" ", start + size // 2, end)
+            if split != -1:
+                end = split
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class DocumentLibrary:
+    def __init__(self, directory: str = LIBRARY_DIRECTORY, encoder=None):
+        self.directory = directory
+        self.encoder = encoder or load_encoder()
+        self._lock = threading.Lock()
+        self._matrix_path = os.path.join(directory, "embeddings.f32")
+        self._chunks_path = os.path.join(directory, "chunks.jsonl")
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        manifest = None
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("encoder") != self.encoder.name:
+                print(f"Library index was built with {manifest.get('encoder')}, "
+                      f"re-indexing with {self.encoder.name}")
+                manifest = None
+
+        if manifest is None:
+            manifest = {"encoder": self.encoder.name, "dimension": self.encoder.dimension,
+                        "count": 0, "capacity": 0, "documents": {}}
+            for path in (self._matrix_path, self._chunks_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.manifest = manifest
+        self.count = manifest["count"]
+        self.documents: Dict[str, Dict] = manifest["documents"]
+        # 已索引过的 PDF 文件字节摘要，启动时据此跳过解析
+        self._files = {file for document in self.documents.values() for file in document.get("files", [])}
+
+        # 内存里只保留每条 chunk 在 chunks.jsonl 中的起始偏移，文本在检索时按需读取；
+        # 只认 manifest 记录的条数，并截掉上次写入一半的尾部
+        self._offsets = array("q")
+        if os.path.exists(self._chunks_path):
+            with open(self._chunks_path, "r+b") as f:
+                offset = 0
+                for line in f:
+                    if len(self._offsets) >= self.count:
+                        break
+                    self._offsets.append(offset)
+                    offset += len(line)
+                f.truncate(offset)
+
+        self._matrix = None
+        if manifest["capacity"]:
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+",
+                                     shape=(manifest["capacity"], self.encoder.dimension))
+
+    def _ensure_capacity(self, rows: int):
+        capacity = self.manifest["capacity"]
+        if self.count + rows <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < self.count + rows:
+            new_capacity *= 2
+
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self._matrix_path, "ab") as f:
+            f.truncate(new_capacity * self.encoder.dimension * 4)
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+",
+                                 shape=(new_capacity, self.encoder.dimension))
+        self.manifest["capacity"] = new_capacity
+
+    def _write_manifest(self):
+        self.manifest["count"] = self.count
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def has_file(self, file_digest: str) -> bool:
+        return file_digest in self._files
+
+    def _remember_file(self, digest: str, file_digest: Optional[str]):
+        # 调用方持有 self._lock
+        if file_digest is None or file_digest in self._files:
+            return
+        self.documents[digest].setdefault("files", []).append(file_digest)
+        self._files.add(file_digest)
+        self._write_manifest()
+
+    def add_document(self, name: str, text: str, file_digest: Optional[str] = None) -> int:
+        digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+        if digest in self.documents:
+            with self._lock:
+                self._remember_file(digest, file_digest)
+            return 0
+
+        chunks = chunk_text(text)
+        embeddings = self.encoder.encode(chunks) if chunks else None
+
+        with self._lock:
+            if digest in self.documents:
+                # 文本相同的另一个文件，只记下它的摘要
+                self._remember_file(digest, file_digest)
+                return 0
+            start = self.count
+            if chunks:
+                self._ensure_capacity(len(chunks))
+                self._matrix[start:start + len(chunks)] = embeddings
+                self._matrix.flush()
+
+                with open(self._chunks_path, "ab") as f:
+                    offset = f.tell()
+                    for i, chunk in enumerate(chunks):
+                        record = {"doc": digest, "name": name, "chunk": i, "text": chunk}
+                        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8", "surrogatepass")
+                        f.write(line)
+                        self._offsets.append(offset)
+                        offset += len(line)
+                self.count += len(chunks)
+
+            # 没有文本的 PDF（例如扫描件）也记下来，下次启动不再重复解析
+            self.documents[digest] = {"name": name, "start": start, "end": self.count,
+                                      "files": [file_digest] if file_digest else []}
+            if file_digest:
+                self._files.add(file_digest)
+            self._write_manifest()
+        return len(chunks)
+
+    def search(self, query: str, k: int = 8) -> List[Dict]:
+        with self._lock:
+            count = self.count
+            matrix = self._matrix
+        if not count or matrix is None:
+            return []
+
+        vector = self.encoder.encode([query])[0]
+        scores = matrix[:count] @ vector
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        with self._lock:
+            offsets = [self._offsets[i] for i in top]
+
+        hits = []
+        with open(self._chunks_path, "rb") as f:
+            for i, offset in zip(top, offsets):
+                f.seek(offset)
+                hits.append(dict(json.loads(f.readline()), score=float(scores[i])))
+        return hits
+
+    def stats(self) -> Dict:
+        return {"documents": len(self.documents), "chunks": self.count, "encoder": self.encoder.name}
+
+
+library = DocumentLibrary()
@@ -4,6 +4,7 @@ from langchain_anthropic import ChatAnthropic
 from langchain.schema.output_parser import StrOutputParser
 import json
 from privacy_agent import PrivacyManager
+from model_router import router
 
 privacy_manager = PrivacyManager()
 
@@ -49,17 +50,9 @@ async def handle_send_email(user_input: str):
         Just return the JSON object, nothing else.
         """)
 
-        claude = ChatAnthropic(
-            model='claude-3-5-sonnet-20240620',
-            temperature=0,
-            max_tokens=8192,
-            max_retries=2
-        )
-
-        email_chain = prompt_template | claude | StrOutputParser()
-        result = email_chain.invoke({
+        result = await router.ainvoke("email", {
             "input": user_input
-        })
+        }, prompt=prompt_template)
 
         parsed_result = json.loads(result)
 
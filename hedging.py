@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from langchain_core.output_parsers import StrOutputParser
+from scheduler import scheduler, describe_model, estimate_tokens, is_retryable_error
+
+# 需要对冲的 chain 名称，逗号分隔，例如 HEDGED_CHAINS=pdf_qa,search_format
+HEDGED_CHAINS = {name.strip() for name in os.getenv("HEDGED_CHAINS", "").split(",") if name.strip()}
+# 每个请求积累的对冲额度，0.1 表示最多约 10% 的请求会额外发一次
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_BURST = 5.0
+# prompt 过大时对冲成本太高，不发
+HEDGE_MAX_PROMPT_TOKENS = int(os.getenv("HEDGE_MAX_PROMPT_TOKENS", "8000"))
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_SAMPLES = 20
+
+_first_token_latency: Dict[str, Deque[float]] = {}
+hedge_stats: Dict[str, Dict[str, int]] = {}
+_budget = {"credits": HEDGE_BURST}
+
+
+def _record_first_token(llm, seconds: float):
+    _, model, _ = describe_model(llm)
+    _first_token_latency.setdefault(model, deque(maxlen=200)).append(seconds)
+
+
+def hedge_delay(llm) -> float:
+    _, model, _ = describe_model(llm)
+    samples = _first_token_latency.get(model)
+    if not samples or len(samples) < MIN_SAMPLES:
+        return DEFAULT_HEDGE_DELAY
+    ordered = sorted(samples)
+    return ordered[int(len(ordered) * 0.95) - 1]
+
+
+def _spend_budget() -> bool:
+    if _budget["credits"] < 1:
+        return False
+    _budget["credits"] -= 1
+    return True
+
+
+def _discard(task: asyncio.Task):
+    task.cancel()
+    # 取走失败任务的异常，避免 "exception was never retrieved"
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+class HedgedChain:
+    def __init__(self, name: str, primary_llm, secondary_llm, prompt=None, enabled: Optional[bool] = None):
+        self.name = name
+        self.primary_llm = primary_llm
+        self.secondary_llm = secondary_llm
+        self.primary = self._build(prompt, primary_llm)
+        self.secondary = self._build(prompt, secondary_llm) if secondary_llm is not None else None
+        self.enabled = name in HEDGED_CHAINS if enabled is None else enabled
+        if secondary_llm is None:
+            self.enabled = False
+        self.stats = hedge_stats.setdefault(name, {
+            "requests": 0,
+            "hedges_fired": 0,
+            "hedges_won": 0,
+            "skipped_budget": 0,
+            "skipped_size": 0,
+        })
+
+    @staticmethod
+    def _build(prompt, llm):
+        if prompt is not None:
+            return prompt | llm | StrOutputParser()
+        return llm | StrOutputParser()
+
+    async def _leg(self, chain, llm, payload: Any, first_token: asyncio.Event,
+                   slotted: Optional[asyncio.Event] = None) -> str:
+        chunks: List[str] = []
+        async with scheduler.slot(llm, payload) as ticket:
+            # 从拿到 slot 开始计时，本地限流排队不算作 provider 延迟
+            started = time.monotonic()
+            if slotted is not None:
+                slotted.set()
+            try:
+                async for chunk in chain.astream(payload):
+                    if not first_token.is_set():
+                        _record_first_token(llm, time.monotonic() - started)
+                        first_token.set()
+                    chunks.append(chunk)
+            except asyncio.CancelledError:
+                # 被对冲请求抢先时，已等待的时间是首 token 延迟的下界，也记下来，
+                # 否则 p95 只由快的样本构成，会越来越低
+                if not first_token.is_set():
+                    _record_first_token(llm, time.monotonic() - started)
+                raise
+            ticket.output = "".join(chunks)
+        return ticket.output
+
+    @staticmethod
+    async def _race(legs: List[Tuple[asyncio.Task, asyncio.Event]]) -> asyncio.Task:
+        # 先吐出第一个 token（或先成功结束）的一路获胜
+        alive = list(legs)
+        while True:
+            for task, event in alive:
+                if event.is_set() or (task.done() and not task.cancelled() and task.exception() is None):
+                    return task
+            alive = [(task, event) for task, event in alive if not task.done()]
+            if not alive:
+                return legs[0][0]
+
+            waiters = [asyncio.create_task(event.wait()) for _, event in alive]
+            try:
+                await asyncio.wait([task for task, _ in alive] + waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+    async def ainvoke(self, payload: Any) -> str:
+        if not self.enabled:
+            return await scheduler.ainvoke(self.primary, payload, self.primary_llm)
+
+        self.stats["requests"] += 1
+        _budget["credits"] = min(HEDGE_BURST, _budget["credits"] + HEDGE_BUDGET)
+
+        primary_token = asyncio.Event()
+        primary_slotted = asyncio.Event()
+        legs = [(asyncio.create_task(
+            self._leg(self.primary, self.primary_llm, payload, primary_token, primary_slotted)), primary_token)]
+        try:
+            # 对冲延迟从主请求拿到 slot 开始算，和首 token 样本的口径一致；
+            # 否则本地限流排队时也会触发对冲
+            waiter = asyncio.create_task(primary_slotted.wait())
+            try:
+                await asyncio.wait([legs[0][0], waiter], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+            waiter = asyncio.create_task(primary_token.wait())
+            try:
+                await asyncio.wait([legs[0][0], waiter],
+                                   timeout=hedge_delay(self.primary_llm),
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+            if not primary_token.is_set() and not legs[0][0].done():
+                if estimate_tokens(payload) > HEDGE_MAX_PROMPT_TOKENS:
+                    self.stats["skipped_size"] += 1
+                elif not _spend_budget():
+                    self.stats["skipped_budget"] += 1
+                else:
+                    self.stats["hedges_fired"] += 1
+                    secondary_token = asyncio.Event()
+                    legs.append((asyncio.create_task(
+                        self._leg(self.secondary, self.secondary_llm, payload, secondary_token)), secondary_token))
+
+            winner = await self._race(legs)
+            for task, _ in legs:
+                if task is not winner:
+                    _discard(task)
+            if winner is not legs[0][0]:
+                self.stats["hedges_won"] += 1
+            result = await winner
+        except asyncio.CancelledError:
+            for task, _ in legs:
+                _discard(task)
+            raise
+        except Exception as e:
+            if not is_retryable_error(e):
+                raise
+            # 对冲路径本身不重试，失败后走普通的带重试调用
+            return await scheduler.ainvoke(self.primary, payload, self.primary_llm)
+        return result
@@ -3,9 +3,10 @@ from langchain_anthropic import ChatAnthropic
 from langchain_openai import OpenAI
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from model_router import router
 
 
-def identify_intent(user_input, history):
+async def identify_intent(user_input, history):
     prompt = f"""
     You are an AI assistant with several functions:
     - "send_email": Write and send an email.
@@ -13,7 +14,7 @@ def identify_intent(user_input, history):
     - "internet_search": Search the internet for information.
     
     Here is the history of the conversation:
-    {history}
+    {history.render()}
     
     
     Here is the user input: \n{user_input}\n.
@@ -32,16 +33,7 @@ def identify_intent(user_input, history):
     No explanation is needed. Just output the function name.
     """
 
-    gpt_4o = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0,
-        max_tokens=16384,
-        max_retries=2
-    )
-
-    gpt_4o_chain = gpt_4o | StrOutputParser()
-
-    intent = gpt_4o_chain.invoke(prompt)
+    intent = await router.ainvoke("intent", prompt)
 
     print("Intent identified:", intent)
 
@@ -1,10 +1,12 @@
+import asyncio
 import os
+import re
 import uuid
 import uvicorn
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pdf_reader import PDFQuestionAnswering
+from pdf_reader import PDFQuestionAnswering, file_digest
 from identify_intent import identify_intent
 from web_search import handle_internet_search
 from langchain_openai import ChatOpenAI
@@ -13,6 +15,13 @@ from email_handler import handle_send_email
 from email_sender import EmailSender
 from meeting_handler import handle_schedule_meeting, meeting_handler
 from privacy_agent import PrivacyManager
+from scheduler import scheduler, current_session
+from hedging import hedge_stats
+from model_router import router
+from session_store import SessionHistory, blob_store
+from doc_index import library
+import profiler
+from cancellation import cancel_on_disconnect, cancellation_scope, cancellation_stats
 
 email_sender = EmailSender()
 app = FastAPI()
@@ -24,6 +33,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(profiler.ProfilingMiddleware)
+
 
 pdf_qa = PDFQuestionAnswering(use_claude=True)
 UPLOAD_DIRECTORY = "./uploaded_pdfs"
@@ -32,10 +43,44 @@ os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 session_files = {}
 session_histories = {}
 
+LIBRARY_TOP_K = 8
+
+
+def index_pdfs(pdf_paths):
+    for pdf_path in pdf_paths:
+        # 去掉上传时加的 "<session_id>_" 前缀
+        name = re.sub(r"^[0-9a-f-]{36}_", "", os.path.basename(pdf_path))
+        try:
+            digest = file_digest(pdf_path)
+            # 字节完全相同的文件已经索引过，不再用 PyMuPDF 解析
+            if library.has_file(digest):
+                continue
+            library.add_document(name, pdf_qa.extract_text_uncached(pdf_path), file_digest=digest)
+        except Exception as e:
+            print(f"Failed to index {pdf_path}: {str(e)}")
+
+
+def release_extracted_keys(future):
+    if not future.cancelled() and future.exception() is None:
+        for key in future.result():
+            blob_store.release(key)
+
+
+@app.on_event("startup")
+async def index_existing_uploads():
+    # 已上传过的 PDF 也加入文档库，重复内容会被跳过
+    pdf_paths = [
+        os.path.join(UPLOAD_DIRECTORY, name)
+        for name in sorted(os.listdir(UPLOAD_DIRECTORY)) if name.lower().endswith(".pdf")
+    ]
+    asyncio.get_running_loop().run_in_executor(None, index_pdfs, pdf_paths)
+
 
 @app.post("/upload_pdf")
-async def upload_pdf(files: list[UploadFile] = File(...), question: str = Form(...)):
+@cancel_on_disconnect
+async def upload_pdf(request: Request, files: list[UploadFile] = File(...), question: str = Form(...)):
     session_id = str(uuid.uuid4())
+    current_session.set(session_id)
     pdf_paths = []
 
     user_input = question
@@ -49,56 +94,101 @@ async def upload_pdf(files: list[UploadFile] = File(...), question: str = Form(.
             f.write(await file.read())
         pdf_paths.append(file_path)
 
-    session_files[session_id] = pdf_paths
+    # 即使客户端中途断开，线程里的解析结果也会留在缓存和文档库中
+    extraction = asyncio.ensure_future(asyncio.to_thread(pdf_qa.extract_keys, pdf_paths))
+    try:
+        with cancellation_scope("extraction"):
+            pdf_keys = await asyncio.shield(extraction)
+    except asyncio.CancelledError:
+        # 线程跑完后再释放它为本请求持有的引用
+        extraction.add_done_callback(release_extracted_keys)
+        raise
+    asyncio.get_running_loop().run_in_executor(None, index_pdfs, pdf_paths)
 
-    pdf_text = pdf_qa.extract_and_label_texts(pdf_paths)
-    answer = pdf_qa.answer_question(pdf_paths, question)
+    try:
+        answer = await pdf_qa.answer_question(pdf_paths, question, pdf_keys=pdf_keys)
+    except BaseException:
+        # 还没交给 SessionHistory，引用由这里释放
+        for key in pdf_keys:
+            blob_store.release(key)
+        raise
 
-    session_histories[session_id] = [
-        {"sender": "System", "text": pdf_text},
-        {"sender": "User", "text": user_input},
-        {"sender": "AI", "text": answer}
-    ]
+    session_files[session_id] = pdf_paths
+    history = SessionHistory()
+    # System 消息只保存每个文件的 blob key，读取历史时才拼出带标签的文本
+    history.attach_documents("System", pdf_keys)
+    history.append("User", user_input)
+    history.append("AI", answer)
+    session_histories[session_id] = history
 
     return JSONResponse(content={"session_id": session_id, "message": answer})
 
 
 @app.post("/ask_question")
-async def ask_question(session_id: str = Form(...), question: str = Form(...)):
+@cancel_on_disconnect
+async def ask_question(request: Request, session_id: str = Form(None), question: str = Form(...),
+                       search_library: bool = Form(False)):
+    # 没有 session 的 PDF 或显式要求时，在整个文档库中检索
+    if session_id is None or (search_library and session_id not in session_files):
+        session_id = session_id or str(uuid.uuid4())
+        current_session.set(session_id)
+        with profiler.wait_span("library_search"):
+            hits = await asyncio.to_thread(library.search, question, LIBRARY_TOP_K)
+        if not hits:
+            raise HTTPException(status_code=404, detail="No documents in the library")
+        answer = await pdf_qa.answer_from_library(question, hits)
+
+        history = session_histories.setdefault(session_id, SessionHistory())
+        history.append("User", question)
+        history.append("AI", answer)
+
+        sources = list(dict.fromkeys(hit["name"] for hit in hits))
+        return JSONResponse(content={"session_id": session_id, "message": answer, "sources": sources})
+
     if session_id not in session_files:
         raise HTTPException(status_code=404, detail="Session not found")
 
+    current_session.set(session_id)
     pdf_paths = session_files[session_id]
 
     user_input = question
-    answer = pdf_qa.answer_question(pdf_paths, question)
+    if search_library:
+        with profiler.wait_span("library_search"):
+            hits = await asyncio.to_thread(library.search, question, LIBRARY_TOP_K)
+        if not hits:
+            raise HTTPException(status_code=404, detail="No documents in the library")
+        answer = await pdf_qa.answer_from_library(question, hits)
+    else:
+        pdf_keys = session_histories[session_id].document_keys("System")
+        answer = await pdf_qa.answer_question(pdf_paths, question, pdf_keys=pdf_keys)
 
-    session_histories[session_id].append({"sender": "User", "text": user_input})
-    session_histories[session_id].append({"sender": "AI", "text": answer})
+    session_histories[session_id].append("User", user_input)
+    session_histories[session_id].append("AI", answer)
 
     return JSONResponse(content={"message": answer})
 
 
 @app.post("/process_input")
+@cancel_on_disconnect
 async def process_input(request: Request):
-    data = await request.json()
+    with profiler.wait_span("json"):
+        data = await request.json()
     user_input = data.get("user_input")
     session_id = data.get("session_id") or str(uuid.uuid4())
 
+    current_session.set(session_id)
+
     if session_id not in session_histories:
-        session_histories[session_id] = []
+        session_histories[session_id] = SessionHistory()
 
-    intent = identify_intent(user_input, session_histories[session_id])
+    intent = await identify_intent(user_input, session_histories[session_id])
 
     if intent == "send_email":
-        session_histories[session_id] = []
+        session_histories[session_id].clear()
         response = await handle_send_email(user_input)
 
-        session_histories[session_id].append({"sender": "User", "text": user_input})
-        session_histories[session_id].append({
-            "sender": "AI",
-            "text": "I've prepared an email preview for you. Please review it."
-        })
+        session_histories[session_id].append("User", user_input)
+        session_histories[session_id].append("AI", "I've prepared an email preview for you. Please review it.")
         return JSONResponse(content=response)
 
     elif intent == "schedule_meeting":
@@ -113,8 +203,8 @@ async def process_input(request: Request):
         response = await default_chat(user_input, session_histories[session_id])
 
     # 存储到历史记录
-    session_histories[session_id].append({"sender": "User", "text": user_input})
-    session_histories[session_id].append({"sender": "AI", "text": response})
+    session_histories[session_id].append("User", user_input)
+    session_histories[session_id].append("AI", response)
 
     return JSONResponse(content={"session_id": session_id, "message": response})
 
@@ -123,14 +213,57 @@ async def get_history(session_id: str):
     if session_id not in session_histories:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    filtered_history = [
-        message for message in session_histories[session_id]
-        if message["sender"] in ["User", "AI"]
-    ]
+    filtered_history = session_histories[session_id].to_list(senders=["User", "AI"])
 
     return JSONResponse(content={"history": filtered_history})
 
 
+@app.get("/metrics/scheduler")
+async def scheduler_metrics():
+    return JSONResponse(content=scheduler.snapshot())
+
+
+@app.get("/metrics/hedging")
+async def hedging_metrics():
+    return JSONResponse(content=hedge_stats)
+
+
+@app.get("/metrics/stages")
+async def stage_metrics():
+    return JSONResponse(content=router.snapshot())
+
+
+@app.get("/metrics/sessions")
+async def session_metrics():
+    return JSONResponse(content={"sessions": len(session_histories), "blobs": blob_store.stats()})
+
+
+@app.get("/metrics/library")
+async def library_metrics():
+    return JSONResponse(content=library.stats())
+
+
+@app.get("/metrics/cancellations")
+async def cancellation_metrics():
+    return JSONResponse(content=cancellation_stats)
+
+
+@app.get("/admin/profiles")
+async def list_profiles(request: Request):
+    if not profiler.is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return JSONResponse(content={"profiles": profiler.list_profiles()})
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    if not profiler.is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if profile_id not in profiler.profiles:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return JSONResponse(content=profiler.profiles[profile_id])
+
+
 @app.post("/send_email")
 async def send_email(email_data: dict):
     result = await email_sender.send_email(email_data)
@@ -11,6 +11,10 @@ from langchain.prompts import ChatPromptTemplate
 from langchain_anthropic import ChatAnthropic
 from langchain.schema.output_parser import StrOutputParser
 from privacy_agent import PrivacyManager
+from model_router import router
+from meeting_parser import (
+    parse_meeting_request, extract_json_object, DEFAULT_DESCRIPTION, DEFAULT_DURATION_MINUTES
+)
 
 privacy_manager = PrivacyManager()
 
@@ -90,54 +94,63 @@ class MeetingHandler:
 meeting_handler = MeetingHandler()
 
 
-async def handle_schedule_meeting(user_input: str):
-    try:
-        # 使用 Ollama 模型解析基本会议信息
-        prompt_template = ChatPromptTemplate.from_template("""
+# 只在规则解析不出的字段上调用本地 LLM
+missing_fields_prompt = ChatPromptTemplate.from_template("""
         Based on this user request: "{input}"
 
-        Extract meeting details or assume defaults as follows:
-        - title: "Meeting with [contact_name]" if not specified
-        - description: "Add your description" if not specified
-        - duration_minutes: 45 if not specified
-        - suggested_time: today + 7 days at 9:00 AM
+        Extract ONLY these fields:
+        - attendees_name: the name of the person to meet, or null
+        - title: a short meeting title if the request states a topic, or null
 
-        Return the result in JSON format:
+        Return exactly this JSON object and nothing else:
         {{
-            "title": "<meeting title>",
-            "description": "<meeting description>",
-            "attendees_name": "<contact_name>",
-            "duration_minutes": <duration in minutes>,
-            "suggested_time": "<YYYY-MM-DDTHH:MM:SS>"
+            "attendees_name": "<contact_name or null>",
+            "title": "<meeting title or null>"
         }}
-
-        ONLY return the JSON object, no explanations.
         """)
 
-        # 本地 LLM 调用
-        llm = privacy_manager.llm
-        meeting_chain = prompt_template | llm | StrOutputParser()
-        result = await meeting_chain.ainvoke({"input": user_input})
-
-        parsed_result = json.loads(result)
-        contact_name = parsed_result["attendees_name"]
 
-        start_time = datetime.now() + timedelta(days=7)
-        start_time = start_time.replace(hour=9, minute=0, second=0)
+async def _extract_missing_fields(user_input: str) -> Dict:
+    result = await router.ainvoke("meeting_extract", {"input": user_input}, prompt=missing_fields_prompt)
+    parsed = extract_json_object(result) or {}
+    # 只保留 schema 中的字符串字段
+    return {
+        key: value.strip()
+        for key, value in parsed.items()
+        if key in ("attendees_name", "title") and isinstance(value, str)
+        and value.strip() and value.strip().lower() not in ("null", "none")
+    }
 
-        attendee_email = await privacy_manager.get_email_address(contact_name)
 
-        if attendee_email:
+async def handle_schedule_meeting(user_input: str):
+    try:
+        parsed_result = parse_meeting_request(user_input, privacy_manager.contacts)
+        contact_names = parsed_result["attendees_names"]
+        title = parsed_result["title"]
+
+        if not contact_names:
+            llm_result = await _extract_missing_fields(user_input)
+            if "attendees_name" in llm_result:
+                contact_names = [llm_result["attendees_name"]]
+            title = title or llm_result.get("title")
+
+        attendees = [privacy_manager.get_sender_email()]
+        for contact_name in contact_names:
+            attendee_email = await privacy_manager.get_email_address(contact_name)
             # remove "" from attendees
-            attendee_email = attendee_email.replace('"', '')
-            attendees = [privacy_manager.get_sender_email(), attendee_email]
-        else:
-            attendees = [privacy_manager.get_sender_email(), "unknown@email.com"]
+            attendees.append(attendee_email.replace('"', '') if attendee_email else "unknown@email.com")
+        if len(attendees) == 1:
+            attendees.append("unknown@email.com")
+
+        start_time = parsed_result["start_time"]
+        if start_time is None:
+            start_time = datetime.now() + timedelta(days=7)
+            start_time = start_time.replace(hour=9, minute=0, second=0, microsecond=0)
 
         # 设定默认值
-        title = parsed_result.get("title", f"Meeting with {contact_name}")
-        description = parsed_result.get("description", "Add your description")
-        duration_minutes = parsed_result.get("duration_minutes", 45)
+        title = title or f"Meeting with {' and '.join(contact_names) or 'Unknown'}"
+        description = DEFAULT_DESCRIPTION
+        duration_minutes = parsed_result["duration_minutes"] or DEFAULT_DURATION_MINUTES
         end_time = start_time + timedelta(minutes=duration_minutes)
 
         meeting_data = {
@@ -0,0 +1,338 @@
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0,
+    "tuesday": 1, "tue": 1, "tues": 1,
+    "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3,
+    "friday": 4, "fri": 4,
+    "saturday": 5, "sat": 5,
+    "sunday": 6, "sun": 6,
+}
+
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3,
+    "april": 4, "apr": 4, "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7,
+    "august": 8, "aug": 8, "september": 9, "sep": 9, "sept": 9,
+    "october": 10, "oct": 10, "november": 11, "nov": 11, "december": 12, "dec": 12,
+}
+
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "half": 0.5}
+
+DEFAULT_DESCRIPTION = "Add your description"
+DEFAULT_DURATION_MINUTES = 45
+DEFAULT_HOUR = 9
+
+_weekday_names = "|".join(sorted(WEEKDAYS, key=len, reverse=True))
+_month_names = "|".join(sorted(MONTHS, key=len, reverse=True))
+_number = r"\d+(?:\.\d+)?|an?|one|two|three|four|five|six"
+_units = r"hours?|hrs?|minutes?|mins?"
+_duration = (
+    rf"(?P<half>half an? hour)\b"
+    rf"|(?P<count>(?:\d+\s+)?\d+/\d+|{_number}|half)[\s-]*(?P<unit>{_units})\b"
+    rf"(?P<and_half>\s+and\s+a\s+half)?"
+)
+
+DURATION_RE = re.compile(rf"(?<![\d./])\b(?:{_duration})", re.I)
+IN_OFFSET_RE = re.compile(rf"\bin\s+(?:{_duration})", re.I)
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+# "1/2 hour" 是时长，不是 1 月 2 日
+SLASH_DATE_RE = re.compile(rf"\b(\d{{1,2}})/(\d{{1,2}})(?:/(\d{{2,4}}))?\b(?!\s*(?:{_units})\b)", re.I)
+MONTH_DAY_RE = re.compile(rf"\b({_month_names})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(\d{{4}}))?\b", re.I)
+DAY_MONTH_RE = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_month_names})\b(?:,?\s+(\d{{4}}))?", re.I)
+WEEKDAY_RE = re.compile(rf"\b(?:(next|this|on)\s+)?({_weekday_names})\b", re.I)
+IN_DAYS_RE = re.compile(rf"\bin\s+({_number})\s+(days?|weeks?)\b", re.I)
+RELATIVE_DAY_RE = re.compile(r"\b(day after tomorrow|tomorrow|today|tonight|next week)\b", re.I)
+TIME_RE = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*(a\.?m\.?|p\.?m\.?)(?=\W|$)", re.I)
+CLOCK_RE = re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")
+AT_HOUR_RE = re.compile(r"\bat\s+(\d{1,2})\b(?!\s*(?:/|:|-|\d))", re.I)
+NAMED_TIME_RE = re.compile(r"\b(noon|midday|midnight|morning|afternoon|evening|tonight)\b", re.I)
+TITLE_RE = re.compile(
+    # "about an hour" / "about 30 minutes" 是估计时长，不是主题
+    rf"\b(?:about(?!\s+\d|\s+(?:(?:{_number}|half)[\s-]+)+(?:{_units})\b)|to discuss|discuss|regarding|re:|on the topic of)\s+(?P<title>.+?)"
+    rf"(?=\s+(?:at|on|for|with|next|this|tomorrow|today|in|from|by)\b|\s+(?:{_weekday_names})\b|[.?!,;]|$)",
+    re.I,
+)
+
+NAMED_HOURS = {"noon": 12, "midday": 12, "midnight": 0, "morning": 9, "afternoon": 14, "evening": 18,
+               "tonight": 19}
+
+
+def _to_number(value: str) -> float:
+    value = value.lower()
+    if value in NUMBER_WORDS:
+        return float(NUMBER_WORDS[value])
+    if "/" in value:
+        # "1/2"、"1 1/2"
+        whole, _, fraction = value.rpartition(" ")
+        numerator, denominator = fraction.split("/")
+        return float(whole or 0) + float(numerator) / (float(denominator) or 1.0)
+    return float(value)
+
+
+def _minutes(match) -> int:
+    if match.group("half"):
+        return 30
+
+    count = _to_number(match.group("count"))
+    if match.group("and_half"):
+        count += 0.5
+    if match.group("unit").lower().startswith("h"):
+        return int(round(count * 60))
+    return int(round(count))
+
+
+def parse_duration(text: str) -> Optional[int]:
+    # "in 30 minutes" 是开始时间的偏移，不是会议时长，先去掉再找时长
+    match = DURATION_RE.search(IN_OFFSET_RE.sub(" ", text))
+    return _minutes(match) if match else None
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[datetime]:
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+
+def _future_date(now: datetime, month: int, day: int, year: Optional[int]) -> Optional[datetime]:
+    if year is not None:
+        return _safe_date(year, month, day)
+    date = _safe_date(now.year, month, day)
+    # 没写年份且日期已过，默认明年
+    if date is not None and date.date() < now.date():
+        date = _safe_date(now.year + 1, month, day)
+    return date
+
+
+def _year(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def parse_date(text: str, now: datetime) -> Optional[datetime]:
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    match = ISO_DATE_RE.search(text)
+    if match:
+        return _safe_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+    match = MONTH_DAY_RE.search(text)
+    if match:
+        return _future_date(now, MONTHS[match.group(1).lower()], int(match.group(2)), _year(match.group(3)))
+
+    match = DAY_MONTH_RE.search(text)
+    if match:
+        return _future_date(now, MONTHS[match.group(2).lower()], int(match.group(1)), _year(match.group(3)))
+
+    match = SLASH_DATE_RE.search(text)
+    if match:
+        # 按美国习惯 month/day 解析
+        return _future_date(now, int(match.group(1)), int(match.group(2)), _year(match.group(3)))
+
+    match = RELATIVE_DAY_RE.search(text)
+    if match:
+        word = match.group(1).lower()
+        if word == "day after tomorrow":
+            return today + timedelta(days=2)
+        if word == "tomorrow":
+            return today + timedelta(days=1)
+        if word == "next week":
+            return today + timedelta(days=7 - today.weekday())
+        return today
+
+    match = IN_DAYS_RE.search(text)
+    if match:
+        count = int(_to_number(match.group(1)))
+        days = count * 7 if match.group(2).lower().startswith("week") else count
+        return today + timedelta(days=days)
+
+    match = WEEKDAY_RE.search(text)
+    if match:
+        # "Tuesday" 取今天之后最近的那个星期二，"next Tuesday" 取下一周的星期二（至少 7 天后）
+        ahead = (WEEKDAYS[match.group(2).lower()] - today.weekday()) % 7
+        if (match.group(1) or "").lower() == "next":
+            return today + timedelta(days=ahead + 7)
+        return today + timedelta(days=ahead or 7)
+
+    return None
+
+
+def parse_relative_start(text: str, now: datetime) -> Optional[datetime]:
+    # "in 30 minutes" / "in 2 hours" 直接给出开始时间
+    match = IN_OFFSET_RE.search(text)
+    if not match:
+        return None
+    return (now + timedelta(minutes=_minutes(match))).replace(second=0, microsecond=0)
+
+
+def _business_hour(hour: int, text: str) -> int:
+    # 没写 am/pm 时按工作时间理解：1~7 点视为下午；提到下午/晚上时一律按下午
+    if not 1 <= hour < 12:
+        return hour
+    named = NAMED_TIME_RE.search(text)
+    if hour < 8 or (named and named.group(1).lower() in ("afternoon", "evening", "tonight")):
+        return hour + 12
+    return hour
+
+
+def parse_time(text: str) -> Optional[Dict[str, int]]:
+    match = TIME_RE.search(text)
+    if match:
+        hour = int(match.group(1)) % 12
+        if match.group(3).lower().startswith("p"):
+            hour += 12
+        return {"hour": hour, "minute": int(match.group(2) or 0)}
+
+    match = CLOCK_RE.search(text)
+    if match:
+        return {"hour": _business_hour(int(match.group(1)), text), "minute": int(match.group(2))}
+
+    match = AT_HOUR_RE.search(text)
+    if match and 1 <= int(match.group(1)) <= 12:
+        return {"hour": _business_hour(int(match.group(1)), text), "minute": 0}
+
+    match = NAMED_TIME_RE.search(text)
+    if match:
+        return {"hour": NAMED_HOURS[match.group(1).lower()], "minute": 0}
+
+    return None
+
+
+def match_contacts(text: str, contacts: Iterable[str]) -> List[str]:
+    lowered = text.lower()
+    matched: List[str] = []
+    taken: List[range] = []
+
+    # 全名优先，其次按名字中的单词匹配
+    candidates = []
+    for name in contacts:
+        candidates.append((name.lower(), name))
+        for part in name.split():
+            if len(part) > 2 and part.lower() != name.lower():
+                candidates.append((part.lower(), name))
+    candidates.sort(key=lambda item: len(item[0]), reverse=True)
+
+    for needle, name in candidates:
+        for match in re.finditer(rf"\b{re.escape(needle)}\b", lowered):
+            span = range(match.start(), match.end())
+            if any(span.start < other.stop and other.start < span.stop for other in taken):
+                continue
+            taken.append(span)
+            if name not in matched:
+                matched.append(name)
+    return matched
+
+
+def parse_title(text: str) -> Optional[str]:
+    match = TITLE_RE.search(text)
+    if not match:
+        return None
+    title = match.group("title").strip(" \"'")
+    return title[:1].upper() + title[1:] if title else None
+
+
+def parse_meeting_request(text: str, contacts: Iterable[str], now: Optional[datetime] = None) -> Dict:
+    now = now or datetime.now()
+    date = parse_date(text, now)
+    time_of_day = parse_time(text)
+
+    start_time = parse_relative_start(text, now)
+    if start_time is None and (date is not None or time_of_day is not None):
+        if date is None:
+            date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            if time_of_day is not None and date.replace(**time_of_day) <= now:
+                date += timedelta(days=1)
+        hour_minute = time_of_day or {"hour": DEFAULT_HOUR, "minute": 0}
+        start_time = date.replace(second=0, microsecond=0, **hour_minute)
+        if time_of_day is None and start_time <= now:
+            # 只给了 "today" 且默认时间已过：取下一个整点，今天没有整点了就顺延到明天
+            next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            if next_hour.date() == now.date():
+                start_time = next_hour
+            else:
+                start_time = start_time + timedelta(days=1)
+
+    return {
+        "title": parse_title(text),
+        "attendees_names": match_contacts(text, contacts),
+        "duration_minutes": parse_duration(text),
+        "start_time": start_time,
+    }
+
+
+def extract_json_object(text: str) -> Optional[Dict]:
+    # 模型经常在 JSON 前后加说明文字或 ``` 代码块，取第一个完整的对象
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        for index in range(start, len(text)):
+            char = text[index]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    candidate = text[start:index + 1]
+                    try:
+                        parsed = json.loads(candidate)
+                    except json.JSONDecodeError:
+                        # 常见问题：结尾多余的逗号
+                        try:
+                            parsed = json.loads(re.sub(r",\s*([}\]])", r"\1", candidate))
+                        except json.JSONDecodeError:
+                            break
+                    if isinstance(parsed, dict):
+                        return parsed
+                    break
+        start = text.find("{", start + 1)
+    return None
+
+
+if __name__ == "__main__":
+    # 固定在 2026-10-19（周一）14:20，逐条核对解析结果
+    now = datetime(2026, 10, 19, 14, 20)
+    contacts = ["Jeff Smith", "Sarah Lee", "Owen"]
+    cases = [
+        ("Schedule a 1/2 hour sync with Jeff", {"duration_minutes": 30, "start_time": None}),
+        ("Call for 1 1/2 hours with Sarah", {"duration_minutes": 90}),
+        ("meet Jeff in 30 minutes", {"duration_minutes": None, "start_time": datetime(2026, 10, 19, 14, 50)}),
+        ("Meet Owen in 2 hours", {"duration_minutes": None, "start_time": datetime(2026, 10, 19, 16, 20)}),
+        ("meet in half an hour for 45 minutes", {"duration_minutes": 45, "start_time": datetime(2026, 10, 19, 14, 50)}),
+        ("meeting with Jeff at 3", {"start_time": datetime(2026, 10, 19, 15, 0)}),
+        ("meeting with Jeff at 2:30", {"start_time": datetime(2026, 10, 19, 14, 30)}),
+        ("Set up a call with Sarah for about an hour tomorrow",
+         {"title": None, "duration_minutes": 60, "start_time": datetime(2026, 10, 20, 9, 0)}),
+        ("Meet Sarah about the Q3 budget on 11/3", {"title": "The Q3 budget", "start_time": datetime(2026, 11, 3, 9, 0)}),
+        ("next Tuesday at 3pm", {"start_time": datetime(2026, 10, 27, 15, 0)}),
+        ("Tuesday at 3pm", {"start_time": datetime(2026, 10, 20, 15, 0)}),
+        ("dinner with Owen tonight", {"start_time": datetime(2026, 10, 19, 19, 0)}),
+        ("tonight at 8", {"start_time": datetime(2026, 10, 19, 20, 0)}),
+        ("sync with Jeff today", {"start_time": datetime(2026, 10, 19, 15, 0)}),
+    ]
+
+    failures = 0
+    for text, expected in cases:
+        result = parse_meeting_request(text, contacts, now=now)
+        wrong = {key: (result[key], value) for key, value in expected.items() if result[key] != value}
+        if wrong:
+            failures += 1
+            print(f"FAIL {text!r}: " + ", ".join(f"{key}={got!r} (expected {want!r})"
+                                                  for key, (got, want) in wrong.items()))
+    print(f"{len(cases) - failures}/{len(cases)} passed")
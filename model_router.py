@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_anthropic import ChatAnthropic
+from langchain_community.llms import Ollama
+from langchain_openai import ChatOpenAI
+from hedging import HedgedChain
+from cancellation import cancellation_scope
+from scheduler import queue_wait
+
+# 从便宜到贵排列
+TIERS = ["local", "small", "large"]
+
+TIER_MODELS = {
+    "local": {"ollama": "llama3.1:8b"},
+    "small": {"openai": "gpt-4o-mini", "anthropic": "claude-3-haiku-20240307"},
+    "large": {"openai": "gpt-4o", "anthropic": "claude-3-5-sonnet-20240620"},
+}
+
+# tier: 期望的质量档位; min_tier: 延迟超预算时最多降到的档位
+# latency_budget: 秒; max_tokens: 该阶段输出上限
+STAGES = {
+    "intent": {"tier": "small", "min_tier": "local", "latency_budget": 1.5, "max_tokens": 16},
+    "search_decision": {"tier": "small", "min_tier": "local", "latency_budget": 1.5, "max_tokens": 8},
+    "search_query": {"tier": "small", "min_tier": "local", "latency_budget": 1.5, "max_tokens": 64},
+    "search_format": {"tier": "large", "min_tier": "small", "latency_budget": 10, "max_tokens": 2048},
+    "chat": {"tier": "large", "min_tier": "small", "latency_budget": 15, "max_tokens": 4096},
+    "pdf_qa": {"tier": "large", "min_tier": "large", "latency_budget": 30, "max_tokens": 4096,
+               "provider": "anthropic"},
+    "email": {"tier": "large", "min_tier": "small", "latency_budget": 10, "max_tokens": 1024,
+              "provider": "anthropic"},
+    # 涉及联系人等隐私信息，只用本地模型
+    "meeting_extract": {"tier": "local", "min_tier": "local", "latency_budget": 10, "max_tokens": 256},
+    "contact_lookup": {"tier": "local", "min_tier": "local", "latency_budget": 5, "max_tokens": 32},
+}
+
+MODEL_STAGES_FILE = os.getenv("MODEL_STAGES_FILE", "model_stages.json")
+# 降级后每隔多少次调用回到期望档位探测一次延迟
+PROBE_INTERVAL = 20
+
+
+def _load_stages() -> Dict[str, Dict]:
+    stages = {name: dict(spec) for name, spec in STAGES.items()}
+    try:
+        with open(MODEL_STAGES_FILE, "r") as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return stages
+
+    for name, spec in overrides.items():
+        stages.setdefault(name, dict(STAGES["chat"])).update(spec)
+    return stages
+
+
+class ModelRouter:
+    def __init__(self):
+        self.stages = _load_stages()
+        self._models: Dict[Tuple[str, str, int], Any] = {}
+        self._latency: Dict[Tuple[str, str], float] = {}
+        self._calls: Dict[str, int] = {}
+
+    def _build(self, provider: str, model: str, max_tokens: int):
+        if provider == "ollama":
+            return Ollama(model=model, temperature=0, num_predict=max_tokens)
+        if provider == "anthropic":
+            return ChatAnthropic(model=model, temperature=0, max_tokens=max_tokens, max_retries=0)
+        return ChatOpenAI(model=model, temperature=0, max_tokens=max_tokens, max_retries=0)
+
+    def _model(self, tier: str, provider: str, max_tokens: int):
+        key = (tier, provider, max_tokens)
+        if key not in self._models:
+            self._models[key] = self._build(provider, TIER_MODELS[tier][provider], max_tokens)
+        return self._models[key]
+
+    def select_tier(self, stage: str) -> str:
+        spec = self.stages[stage]
+        preferred = TIERS.index(spec["tier"])
+        lowest = TIERS.index(spec.get("min_tier", spec["tier"]))
+        candidates = [TIERS[i] for i in range(preferred, lowest - 1, -1)]
+
+        calls = self._calls.get(stage, 0)
+        self._calls[stage] = calls + 1
+        if calls % PROBE_INTERVAL == 0:
+            return candidates[0]
+
+        for tier in candidates:
+            latency = self._latency.get((stage, tier))
+            if latency is None or latency <= spec["latency_budget"]:
+                return tier
+        return min(candidates, key=lambda tier: self._latency[(stage, tier)])
+
+    def chain(self, stage: str, prompt=None, provider: Optional[str] = None) -> Tuple[str, HedgedChain]:
+        spec = self.stages[stage]
+        tier = self.select_tier(stage)
+        providers = list(TIER_MODELS[tier])
+        primary = provider or spec.get("provider")
+        if primary not in providers:
+            primary = providers[0]
+        secondary = next((p for p in providers if p != primary), None)
+
+        primary_llm = self._model(tier, primary, spec["max_tokens"])
+        secondary_llm = self._model(tier, secondary, spec["max_tokens"]) if secondary else None
+        return tier, HedgedChain(stage, primary_llm, secondary_llm, prompt=prompt)
+
+    def record(self, stage: str, tier: str, seconds: float):
+        key = (stage, tier)
+        previous = self._latency.get(key)
+        self._latency[key] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    async def ainvoke(self, stage: str, payload: Any, prompt=None, provider: Optional[str] = None) -> str:
+        tier, chain = self.chain(stage, prompt, provider)
+        started = time.monotonic()
+        waited = [0.0]
+        token = queue_wait.set(waited)
+        try:
+            with cancellation_scope(f"llm:{stage}"):
+                result = await chain.ainvoke(payload)
+        finally:
+            queue_wait.reset(token)
+        # 只记录模型本身的耗时，本地限流排队不应让阶段降级
+        self.record(stage, tier, max(0.0, time.monotonic() - started - waited[0]))
+        return result
+
+    def snapshot(self) -> Dict:
+        return {
+            stage: {
+                "tier": spec["tier"],
+                "min_tier": spec.get("min_tier", spec["tier"]),
+                "latency_budget": spec["latency_budget"],
+                "max_tokens": spec["max_tokens"],
+                "latency": {tier: self._latency.get((stage, tier)) for tier in TIERS},
+            }
+            for stage, spec in self.stages.items()
+        }
+
+
+router = ModelRouter()
@@ -1,3 +1,6 @@
+import asyncio
+import hashlib
+import threading
 import openai
 import fitz  # PyMuPDF
 
@@ -6,45 +9,113 @@ from langchain_anthropic import ChatAnthropic
 from langchain_openai import OpenAI
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from collections import OrderedDict
+from model_router import router
+from session_store import blob_store, label_documents
+from profiler import wait_span
+from cancellation import cancellation_scope
 
 load_dotenv()
 
+EXTRACTION_CACHE_SIZE = 256
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(pdf_path):
+    with open(pdf_path, "rb") as f:
+        return _digest(f.read())
+
 
 class PDFQuestionAnswering:
-    def __init__(self, model_name="gpt-4o", use_claude=False):
+    def __init__(self, use_claude=False):
         self.use_claude = use_claude
+        # 具体模型和输出上限由 model_router 的 "pdf_qa" 阶段决定
+        self.provider = "anthropic" if use_claude else "openai"
+        # 文件内容摘要 -> blob key，同一份 PDF 只解析一次
+        self._extracted: "OrderedDict[str, str]" = OrderedDict()
+        # 上传请求会在工作线程里调用 extract_keys
+        self._lock = threading.Lock()
 
-        if self.use_claude:
-            self.model = ChatAnthropic(
-                model='claude-3-5-sonnet-20240620',
-                temperature=0,
-                max_tokens=8192,
-                max_retries=2
-            )
-        else:
-            self.model = ChatOpenAI(
-                model=model_name,
-                temperature=0,
-                max_tokens=16384,
-                max_retries=2
-            )
+    @staticmethod
+    def _read_pdf(pdf_path):
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+        return data, _digest(data)
+
+    @staticmethod
+    def _parse(data):
+        with wait_span("pdf_extract"):
+            doc = fitz.open(stream=data, filetype="pdf")
+            text = "".join(page.get_text() for page in doc)
+            doc.close()
+        return text
+
+    def _extract_key(self, pdf_path, retain=False):
+        data, digest = self._read_pdf(pdf_path)
+
+        with self._lock:
+            key = self._extracted.get(digest)
+            if key is not None:
+                self._extracted.move_to_end(digest)
+                if retain:
+                    blob_store.retain(key)
+                return key
+
+        text = self._parse(data)
 
-        self.chain = self.model | StrOutputParser()
+        with self._lock:
+            key = self._extracted.get(digest)
+            if key is None:
+                key = blob_store.put(text)
+                self._extracted[digest] = key
+            if retain:
+                blob_store.retain(key)
+            if len(self._extracted) > EXTRACTION_CACHE_SIZE:
+                _, evicted = self._extracted.popitem(last=False)
+                blob_store.release(evicted)
+        return key
+
+    def extract_text(self, pdf_path):
+        # 读取期间持有引用，避免其他线程恰好把它从 LRU 里淘汰
+        key = self._extract_key(pdf_path, retain=True)
+        try:
+            return blob_store.get(key)
+        finally:
+            blob_store.release(key)
+
+    def extract_text_uncached(self, pdf_path):
+        # 给文档库索引用：命中缓存就直接读，不命中也不写回，也不改变 LRU 顺序
+        data, digest = self._read_pdf(pdf_path)
+        with self._lock:
+            key = self._extracted.get(digest)
+            if key is not None:
+                return blob_store.get(key)
+        return self._parse(data)
+
+    def extract_keys(self, pdf_paths):
+        # 每个 key 都为调用方多持有一个引用，交给 SessionHistory.attach_documents 或自行 release
+        keys = []
+        try:
+            for pdf_path in pdf_paths:
+                keys.append(self._extract_key(pdf_path, retain=True))
+        except BaseException:
+            for key in keys:
+                blob_store.release(key)
+            raise
+        return keys
 
     def extract_and_label_texts(self, pdf_paths):
-        labeled_text = ""
-        for idx, pdf_path in enumerate(pdf_paths, start=1):
-            doc = fitz.open(pdf_path)
-            text = f"// pdf {idx}:\n"
-            for page_num in range(doc.page_count):
-                page = doc[page_num]
-                text += page.get_text()
-            labeled_text += text + "\n\n"
-            doc.close()
-        return labeled_text
+        return label_documents(self.extract_text(pdf_path) for pdf_path in pdf_paths)
 
-    def answer_question(self, pdf_paths, question):
-        pdf_text = self.extract_and_label_texts(pdf_paths)
+    async def answer_question(self, pdf_paths, question, pdf_keys=None):
+        if pdf_keys is None:
+            with cancellation_scope("extraction"):
+                pdf_text = await asyncio.to_thread(self.extract_and_label_texts, pdf_paths)
+        else:
+            pdf_text = label_documents(blob_store.get(key) for key in pdf_keys)
         prompt = f"""
         Given the following text, answer the question:
 
@@ -52,9 +123,22 @@ class PDFQuestionAnswering:
 
         Question: {question}
         """
-        answer = self.chain.invoke(prompt)
+        answer = await router.ainvoke("pdf_qa", prompt, provider=self.provider)
         return answer  # 返回答案和PDF文本
 
+    async def answer_from_library(self, question, hits):
+        excerpts = "\n\n".join(
+            f"// {hit['name']} (excerpt {hit['chunk'] + 1}):\n{hit['text']}" for hit in hits
+        )
+        prompt = f"""
+        Given the following excerpts from previously uploaded PDFs, answer the question:
+
+        {excerpts}
+
+        Question: {question}
+        """
+        return await router.ainvoke("pdf_qa", prompt, provider=self.provider)
+
 
 if __name__ == "__main__":
     pdf_qa = PDFQuestionAnswering(use_claude=True)
@@ -65,5 +149,5 @@ if __name__ == "__main__":
     question = f"\nGiven are {pdf_num} PDFs. Please answer the question by reading the text from the PDFs.\n"
     question += "Summarize the main areas of the PDFs."
     question += "\nNo explanation is needed. Just answerthe question.\n"
-    answer = pdf_qa.answer_question(pdf_path, question)
+    answer = asyncio.run(pdf_qa.answer_question(pdf_path, question))
     print("Answer:", answer)
@@ -1,15 +1,14 @@
 from typing import Dict, Optional
-from langchain_community.llms import Ollama
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
 import json
+from model_router import router
+from meeting_parser import match_contacts
 import os
 
 
 class PrivacyManager:
     def __init__(self):
-        self.llm = Ollama(model="llama3.1:8b", temperature=0)
-
         self.contacts = self._load_contacts()
         self.personal_info = self._load_personal_info()
 
@@ -47,7 +46,16 @@ class PrivacyManager:
         with open("private/personal_info.json", "w") as f:
             json.dump(info, f, indent=2)
 
+    def find_contact(self, name: str) -> Optional[str]:
+        matches = match_contacts(name, self.contacts)
+        return matches[0] if matches else None
+
     async def get_email_address(self, name: str) -> Optional[str]:
+        # 本地能匹配上的联系人直接返回，不调用 LLM
+        contact = self.find_contact(name)
+        if contact:
+            return self.contacts[contact]
+
         prompt = ChatPromptTemplate.from_template("""
         Based on this contact name: {name}
         And this contacts database: {contacts}
@@ -59,16 +67,10 @@ class PrivacyManager:
         Format your response as just the email address or "UNKNOWN", nothing else.
         """)
 
-        chain = (
-                prompt
-                | self.llm
-                | StrOutputParser()
-        )
-
-        result = await chain.ainvoke({
+        result = await router.ainvoke("contact_lookup", {
             "name": name,
             "contacts": json.dumps(self.contacts)
-        })
+        }, prompt=prompt)
 
         print("results", result)
 
@@ -0,0 +1,154 @@
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers
+
+# 按比例随机采样，0 表示只在请求带 X-Profile 头（且 X-Admin-Token 正确）时采集
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+MAX_PROFILES = 50
+TOP_FUNCTIONS = 30
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+# cProfile 同一线程同时只能开一个，其余被采样的请求只记录等待分布
+_cpu_profiler_lock = threading.Lock()
+
+profiles: "OrderedDict[str, Dict]" = OrderedDict()
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.waits: Dict[str, float] = {}
+        self.wait_counts: Dict[str, int] = {}
+
+    def add_wait(self, name: str, seconds: float):
+        self.waits[name] = self.waits.get(name, 0.0) + seconds
+        self.wait_counts[name] = self.wait_counts.get(name, 0) + 1
+
+
+class wait_span:
+    # 未开启采集时只有一次 ContextVar.get 的开销
+    __slots__ = ("name", "profile", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = _current_profile.get()
+        if self.profile is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profile is not None:
+            self.profile.add_wait(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def is_admin(headers) -> bool:
+    # 没配置 ADMIN_TOKEN 时管理接口和 X-Profile 头一律不可用
+    return ADMIN_TOKEN is not None and headers.get("x-admin-token") == ADMIN_TOKEN
+
+
+def should_profile(scope) -> bool:
+    if scope["path"].startswith("/admin"):
+        return False
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if ADMIN_TOKEN is None:
+        return False
+    headers = Headers(scope=scope)
+    return bool(headers.get("x-profile")) and is_admin(headers)
+
+
+def _hotspots(profiler: cProfile.Profile) -> List[Dict]:
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": function,
+            "location": f"{filename}:{line}",
+            "calls": ncalls,
+            "self_ms": round(tottime * 1000, 3),
+            "cumulative_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["self_ms"], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _store(record: Dict):
+    profiles[record["id"]] = record
+    while len(profiles) > MAX_PROFILES:
+        profiles.popitem(last=False)
+
+
+class ProfilingMiddleware:
+    # 纯 ASGI 中间件：不采样的请求直接交给 app，不经过 BaseHTTPMiddleware 的包装
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        status = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        profiler = cProfile.Profile() if _cpu_profiler_lock.acquire(blocking=False) else None
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                # 事件循环是共享的，同一时间段内其他请求的 CPU 时间也会被记入
+                profiler.enable()
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _cpu_profiler_lock.release()
+            _current_profile.reset(token)
+            wall = time.perf_counter() - started
+
+            waited = sum(profile.waits.values())
+            _store({
+                "id": profile.id,
+                "method": profile.method,
+                "path": profile.path,
+                "status": status,
+                "started_at": profile.started_at,
+                "wall_ms": round(wall * 1000, 3),
+                "waits_ms": {name: round(seconds * 1000, 3) for name, seconds in profile.waits.items()},
+                "wait_counts": profile.wait_counts,
+                "other_ms": round(max(0.0, wall - waited) * 1000, 3),
+                "cpu_profiled": profiler is not None,
+                "hotspots": _hotspots(profiler) if profiler is not None else [],
+            })
+
+
+def list_profiles() -> List[Dict]:
+    return [
+        {key: value for key, value in record.items() if key != "hotspots"}
+        for record in reversed(profiles.values())
+    ]
@@ -0,0 +1,359 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from profiler import wait_span
+
+# 当前请求所属的 session，用于跨 session 的公平排队
+current_session: ContextVar[str] = ContextVar("current_session", default="anonymous")
+# 调用方放一个 [0.0]，slot 把本地排队时间累加进去，用于从阶段耗时中扣除
+queue_wait: ContextVar[Optional[list]] = ContextVar("queue_wait", default=None)
+
+# rpm / tpm 为 0 表示不限制。OpenAI 和 Anthropic 的配额按模型计算，
+# 默认只用 MODEL_LIMITS；账号级别的总配额可用 RATE_LIMIT_<PROVIDER>_TPM 设置
+PROVIDER_LIMITS = {
+    "openai": {"rpm": 0, "tpm": 0},
+    "anthropic": {"rpm": 0, "tpm": 0},
+    "ollama": {"rpm": 0, "tpm": 0},
+}
+
+MODEL_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000, "concurrency": 4, "max_concurrency": 32},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000, "concurrency": 8, "max_concurrency": 64},
+    "claude-3-5-sonnet-20240620": {"rpm": 50, "tpm": 40000, "concurrency": 2, "max_concurrency": 16},
+    "claude-3-haiku-20240307": {"rpm": 50, "tpm": 50000, "concurrency": 4, "max_concurrency": 32},
+    "llama3.1:8b": {"rpm": 0, "tpm": 0, "concurrency": 1, "max_concurrency": 2},
+}
+
+DEFAULT_MODEL_LIMITS = {"rpm": 0, "tpm": 0, "concurrency": 2, "max_concurrency": 16}
+
+MAX_ATTEMPTS = 3
+BASE_BACKOFF_SECONDS = 1.0
+DEFAULT_RATE_LIMIT_PAUSE = 5.0
+# 归一化延迟超过历史最好值的这个倍数时，认为服务端在排队，主动降低并发
+LATENCY_BACKOFF_FACTOR = 3.0
+
+
+def _env_limit(scope: str, key: str, default: int) -> int:
+    name = f"RATE_LIMIT_{scope}_{key}".upper()
+    for ch in "-.:":
+        name = name.replace(ch, "_")
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def estimate_tokens(payload: Any) -> int:
+    # 粗略估计：英文大约 4 个字符一个 token
+    return len(str(payload)) // 4 + 1
+
+
+def describe_model(llm) -> Tuple[str, str, int]:
+    class_name = type(llm).__name__.lower()
+    if "anthropic" in class_name:
+        provider = "anthropic"
+    elif "openai" in class_name:
+        provider = "openai"
+    elif "ollama" in class_name:
+        provider = "ollama"
+    else:
+        provider = class_name
+
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or class_name
+    max_tokens = getattr(llm, "max_tokens", None) or 0
+    return provider, model, max_tokens
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return _status_code(error) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_retryable_error(error: Exception) -> bool:
+    if is_rate_limit_error(error):
+        return True
+    status = _status_code(error)
+    if status is not None and status >= 500:
+        return True
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError")
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# 按 session 轮转放行，最多 limit 个同时持有
+class FairQueue:
+    def __init__(self, limit: float):
+        self.limit = float(limit)
+        self.active = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, session_id: str):
+        if not self._waiters and self.active < int(self.limit):
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 刚分到名额就被取消，把名额还回去
+                self.release()
+            else:
+                queue = self._waiters.get(session_id)
+                if queue and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiters[session_id]
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.active < int(self.limit):
+            session_id, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(session_id)
+            else:
+                del self._waiters[session_id]
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # 同一时间只有一个请求在等 token，排队的请求按 session 轮转，
+        # 避免 TPM 吃紧时一个 session 的连续请求把其他 session 堵在后面
+        self._turns = FairQueue(1)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float, session_id: str = "anonymous") -> float:
+        if self.capacity <= 0:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+
+        await self._turns.acquire(session_id)
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return amount
+                    wait = (amount - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+        finally:
+            self._turns.release()
+
+    def refund(self, amount: float):
+        if self.capacity <= 0 or amount <= 0:
+            return
+        self._refill(time.monotonic())
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds: float):
+        if self.capacity <= 0:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+# AIMD 调整并发上限，排队时按 session 轮转放行
+class AdaptiveLimiter(FairQueue):
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        super().__init__(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+
+    def on_success(self, latency: float):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+
+        if self.latency > LATENCY_BACKOFF_FACTOR * self.best_latency:
+            self.limit = max(self.minimum, self.limit * 0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def on_rate_limited(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class _Ticket:
+    def __init__(self):
+        self.output: Any = None
+
+
+class _Lane:
+    def __init__(self, provider: str, model: str):
+        defaults = MODEL_LIMITS.get(model, DEFAULT_MODEL_LIMITS)
+        scope = f"{provider}_{model}"
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(_env_limit(scope, "rpm", defaults["rpm"]))
+        self.tokens = TokenBucket(_env_limit(scope, "tpm", defaults["tpm"]))
+        self.limiter = AdaptiveLimiter(
+            _env_limit(scope, "concurrency", defaults["concurrency"]),
+            _env_limit(scope, "max_concurrency", defaults["max_concurrency"]),
+        )
+        self.calls = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+
+class ModelScheduler:
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self._providers: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._lanes: Dict[Tuple[str, str], _Lane] = {}
+
+    def _provider_buckets(self, provider: str) -> Tuple[TokenBucket, TokenBucket]:
+        if provider not in self._providers:
+            defaults = PROVIDER_LIMITS.get(provider, {"rpm": 0, "tpm": 0})
+            self._providers[provider] = (
+                TokenBucket(_env_limit(provider, "rpm", defaults["rpm"])),
+                TokenBucket(_env_limit(provider, "tpm", defaults["tpm"])),
+            )
+        return self._providers[provider]
+
+    def lane(self, llm) -> _Lane:
+        provider, model, _ = describe_model(llm)
+        key = (provider, model)
+        if key not in self._lanes:
+            self._lanes[key] = _Lane(provider, model)
+        return self._lanes[key]
+
+    def _throttle(self, lane: _Lane, error: Exception):
+        pause = retry_after_seconds(error) or DEFAULT_RATE_LIMIT_PAUSE
+        lane.rate_limited += 1
+        lane.limiter.on_rate_limited()
+        # 暂停整个 provider 的 bucket，避免所有请求同时重试
+        for bucket in self._provider_buckets(lane.provider):
+            bucket.pause(pause)
+        lane.requests.pause(pause)
+        lane.tokens.pause(pause)
+
+    @asynccontextmanager
+    async def slot(self, llm, payload: Any, session_id: Optional[str] = None):
+        lane = self.lane(llm)
+        _, _, max_tokens = describe_model(llm)
+        # OpenAI 按 prompt + max_tokens 计算 TPM，这里按同样方式预估
+        cost = estimate_tokens(payload) + max_tokens
+        provider_requests, provider_tokens = self._provider_buckets(lane.provider)
+        session_id = session_id or current_session.get()
+
+        reserved = []
+        dispatched = False
+        output_tokens = 0
+        queued_at = time.monotonic()
+        try:
+            # 先等 bucket 再占并发名额，避免在 TPM 上睡眠时占着 AIMD 名额；
+            # bucket 和 AIMD 的排队都按 session 轮转
+            with wait_span("llm_queue"):
+                await provider_requests.acquire(1, session_id)
+                reserved.append((provider_tokens, await provider_tokens.acquire(cost, session_id)))
+                await lane.requests.acquire(1, session_id)
+                reserved.append((lane.tokens, await lane.tokens.acquire(cost, session_id)))
+                await lane.limiter.acquire(session_id)
+            waited = queue_wait.get()
+            if waited is not None:
+                waited[0] += time.monotonic() - queued_at
+
+            try:
+                lane.calls += 1
+                started = time.monotonic()
+                ticket = _Ticket()
+                dispatched = True
+                try:
+                    with wait_span(f"llm:{lane.provider}"):
+                        yield ticket
+                except Exception as e:
+                    lane.failures += 1
+                    if is_rate_limit_error(e):
+                        self._throttle(lane, e)
+                    raise
+                else:
+                    # 按输出长度归一化，避免把长回答误判为服务端排队
+                    output_tokens = estimate_tokens(ticket.output) if ticket.output is not None else 0
+                    elapsed = time.monotonic() - started
+                    lane.limiter.on_success(elapsed / max(1.0, output_tokens / 100))
+            finally:
+                lane.limiter.release()
+        finally:
+            # 没发出去（排队时被取消等）就全额退还；发出去了只退 max_tokens 里没用完的部分
+            unused = max(0, max_tokens - output_tokens)
+            for bucket, amount in reserved:
+                bucket.refund(amount if not dispatched else min(unused, amount))
+
+    async def ainvoke(self, chain, payload: Any, llm, session_id: Optional[str] = None):
+        for attempt in range(self.max_attempts):
+            try:
+                async with self.slot(llm, payload, session_id) as ticket:
+                    result = await chain.ainvoke(payload)
+                    ticket.output = result
+                return result
+            except Exception as e:
+                if attempt + 1 >= self.max_attempts or not is_retryable_error(e):
+                    raise
+                delay = BASE_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"Model call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict:
+        return {
+            f"{lane.provider}/{lane.model}": {
+                "concurrency_limit": round(lane.limiter.limit, 2),
+                "active": lane.limiter.active,
+                "queued": lane.limiter.queued,
+                "latency": lane.limiter.latency,
+                "calls": lane.calls,
+                "rate_limited": lane.rate_limited,
+                "failures": lane.failures,
+            }
+            for lane in self._lanes.values()
+        }
+
+
+scheduler = ModelScheduler()
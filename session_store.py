@@ -0,0 +1,149 @@
+import hashlib
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 超过这个长度的文本按引用存进 blob store
+INLINE_LIMIT = 2048
+
+# sender 字符串全局只存一份，消息里只记编号
+_sender_names: List[str] = []
+_sender_codes: Dict[str, int] = {}
+
+
+def label_documents(texts: Iterable[str]) -> str:
+    return "".join(f"// pdf {idx}:\n{text}\n\n" for idx, text in enumerate(texts, start=1))
+
+
+def _sender_code(sender: str) -> int:
+    code = _sender_codes.get(sender)
+    if code is None:
+        code = len(_sender_names)
+        _sender_names.append(sender)
+        _sender_codes[sender] = code
+    return code
+
+
+class BlobStore:
+    def __init__(self):
+        self._blobs: Dict[str, str] = {}
+        self._refs: Dict[str, int] = {}
+        # PDF 解析在工作线程里也会 put/release
+        self._lock = threading.Lock()
+
+    def put(self, text: str) -> str:
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+        with self._lock:
+            if key not in self._blobs:
+                self._blobs[key] = text
+                self._refs[key] = 0
+            self._refs[key] += 1
+        return key
+
+    def retain(self, key: str):
+        with self._lock:
+            self._refs[key] += 1
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            return self._blobs[key]
+
+    def release(self, key: str):
+        with self._lock:
+            self._refs[key] -= 1
+            if self._refs[key] <= 0:
+                del self._refs[key]
+                del self._blobs[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "blobs": len(self._blobs),
+                "references": sum(self._refs.values()),
+                "chars": sum(len(text) for text in self._blobs.values()),
+            }
+
+
+blob_store = BlobStore()
+
+
+class BlobRef:
+    # documents 为 True 时每个 key 是一份 PDF 的文本，读取时才加上 "// pdf N:" 标签
+    __slots__ = ("keys", "documents")
+
+    def __init__(self, keys: Iterable[str], documents: bool = False):
+        self.keys = tuple(keys)
+        self.documents = documents
+
+
+class Message:
+    __slots__ = ("sender", "text")
+
+    def __init__(self, sender: str, text: str):
+        self.sender = sender
+        self.text = text
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"sender": self.sender, "text": self.text}
+
+
+class SessionHistory:
+    __slots__ = ("_senders", "_texts", "_store")
+
+    def __init__(self, store: BlobStore = blob_store):
+        self._senders = array("H")
+        self._texts: List[object] = []
+        self._store = store
+
+    def append(self, sender: str, text: str, attachment: bool = False):
+        self._senders.append(_sender_code(sender))
+        if attachment or len(text) > INLINE_LIMIT:
+            self._texts.append(BlobRef([self._store.put(text)]))
+        else:
+            self._texts.append(text)
+
+    def attach_documents(self, sender: str, keys: Iterable[str]):
+        # 接管调用方对这些 key 持有的引用
+        self._senders.append(_sender_code(sender))
+        self._texts.append(BlobRef(keys, documents=True))
+
+    def document_keys(self, sender: str) -> Optional[Tuple[str, ...]]:
+        code = _sender_code(sender)
+        for index, item in enumerate(self._texts):
+            if self._senders[index] == code and isinstance(item, BlobRef) and item.documents:
+                return item.keys
+        return None
+
+    def clear(self):
+        for item in self._texts:
+            if isinstance(item, BlobRef):
+                for key in item.keys:
+                    self._store.release(key)
+        self._senders = array("H")
+        self._texts = []
+
+    def _text(self, index: int) -> str:
+        item = self._texts[index]
+        if isinstance(item, BlobRef):
+            if item.documents:
+                return label_documents(self._store.get(key) for key in item.keys)
+            return self._store.get(item.keys[0])
+        return item
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __iter__(self) -> Iterator[Message]:
+        return self.messages()
+
+    def messages(self, senders: Optional[Iterable[str]] = None) -> Iterator[Message]:
+        codes = None if senders is None else {_sender_code(sender) for sender in senders}
+        for index, code in enumerate(self._senders):
+            if codes is None or code in codes:
+                yield Message(_sender_names[code], self._text(index))
+
+    def render(self, senders: Optional[Iterable[str]] = None) -> str:
+        return "\n".join(f"{message.sender}: {message.text}" for message in self.messages(senders))
+
+    def to_list(self, senders: Optional[Iterable[str]] = None) -> List[Dict[str, str]]:
+        return [message.to_dict() for message in self.messages(senders)]
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 from dotenv import load_dotenv
 import os
@@ -7,6 +8,9 @@ from langchain_community.utilities import BingSearchAPIWrapper
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_anthropic import ChatAnthropic
+from model_router import router
+from profiler import wait_span
+from cancellation import cancellation_scope
 
 
 load_dotenv()
@@ -15,12 +19,6 @@ os.environ["BING_SEARCH_URL"] = "https://api.bing.microsoft.com/v7.0/search"
 
 
 async def handle_internet_search(user_input, history):
-    gpt_4o = ChatOpenAI(model="gpt-4o", temperature=0, max_tokens=16384, max_retries=2)
-    chain = gpt_4o | StrOutputParser()
-
-    claude = ChatAnthropic(model='claude-3-5-sonnet-20240620', temperature=0, max_tokens=8192, max_retries=2)
-    claude_chain = claude | StrOutputParser()
-
     prompt = f"""
     Given is the history of the conversation and a user input which is asking for information.
     
@@ -31,14 +29,14 @@ async def handle_internet_search(user_input, history):
     ONLY output the text, no explanation.
     
     // History:
-    {history}
+    {history.render()}
     
     // User input:
     {user_input}
     
     """
 
-    response = claude_chain.invoke(prompt)
+    response = await router.ainvoke("search_decision", prompt)
 
     if "normal chat" in response:
         return "normal chat"
@@ -60,11 +58,12 @@ async def handle_internet_search(user_input, history):
     // user input:
     """
 
-    query = chain.invoke(prompt + user_input)
+    query = await router.ainvoke("search_query", prompt + user_input)
 
     print("Today's date is:", today)
 
-    results = bing_search.results(query, 5)
+    with wait_span("search"), cancellation_scope("search"):
+        results = await asyncio.to_thread(bing_search.results, query, 5)
     response_text = "\n".join([f"{res['title']}: {res['link']}\nSnippet: {res['snippet']}" for res in results])
 
     prompt = f"""
@@ -86,6 +85,6 @@ async def handle_internet_search(user_input, history):
         
     """
 
-    response_text = chain.invoke(prompt + response_text)
+    response_text = await router.ainvoke("search_format", prompt + response_text)
 
     return response_text